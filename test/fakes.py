@@ -0,0 +1,65 @@
+import threading
+
+
+class FakeResponse(object):
+    """
+    Response that yields `chunks` (or nothing, once closed). If `on_chunk` is
+    given it is called before each chunk is yielded. If `stall` is True, it then
+    blocks until closed.
+    """
+
+    def __init__(self, chunks=(), headers=None, url=None, status_code=200,
+                 on_chunk=None, stall=False):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.chunks = chunks
+        self.on_chunk = on_chunk
+        self.stall = stall
+        self.closed = threading.Event()
+
+    def iter_content(self, chunk_size=1):
+        if self.closed.is_set():
+            return
+
+        for i, chunk in enumerate(self.chunks):
+            if self.on_chunk:
+                self.on_chunk(i)
+            yield chunk
+
+        if self.stall:
+            self.closed.wait(5)
+            if self.closed.is_set():
+                raise IOError('Connection closed.')
+
+    def close(self):
+        self.closed.set()
+
+
+class FakeSession(object):
+    """
+    Session returning `responses` in turn, or, if `responses` is a function,
+    the result of calling it with each URL. If `on_get` is given it is called
+    after each request is made, before the response is returned.
+    """
+
+    def __init__(self, responses, on_get=None):
+        self.responses = responses if callable(responses) else list(responses)
+        self.on_get = on_get
+        self.calls = []
+        self.returned = []
+
+    def get(self, url, **kwargs):
+        self.calls.append(url)
+
+        if callable(self.responses):
+            response = self.responses(url)
+        else:
+            response = self.responses.pop(0)
+
+        self.returned.append(response)
+
+        if self.on_get:
+            self.on_get(url)
+
+        return response
@@ -0,0 +1,123 @@
+import os
+import json
+
+import pytest
+
+from ukcp_api_client import utils
+from ukcp_api_client.client import UKCPApiClient
+from ukcp_api_client.cassette import RecordingSession, ReplaySession, strip_api_key
+from ukcp_api_client.utils import save_url_to_local_file, read_xml_response, ResponseTooLarge
+
+from test.fakes import FakeResponse, FakeSession
+
+
+_API_KEY = 'hGIG234234g7sNOHWLof982LOSHL34g7'
+_BASE_URL = 'https://ukclimateprojections-ui.metoffice.gov.uk'
+_REQUEST_URL = _BASE_URL + '/wps?Request=Execute&Identifier=LS3_Subset_01&Format=text/xml'
+_STATUS_URL = _BASE_URL + '/status/4aa3b60afa489a11b9772c8a1d956625'
+_FILE_URL = _BASE_URL + '/dl/0/4aa3b60afa489a11b9772c8a1d956625/subset.csv'
+
+_STATUS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ExecuteResponse xmlns="http://www.opengeospatial.net/wps" statusLocation="{}" version="1.0.0">
+	<Status>
+			<{}>{}</{}>
+	</Status>
+	<FileURL>{}</FileURL>
+</ExecuteResponse>"""
+
+
+def _status_xml(status, message):
+    return _STATUS_XML.format(_STATUS_URL, status, message, status, _FILE_URL)
+
+
+def _read_records(path):
+    with open(path) as cassette:
+        return [json.loads(line) for line in cassette]
+
+
+def test_strip_api_key():
+    assert(strip_api_key(_FILE_URL + '?ApiKey=' + _API_KEY) == _FILE_URL)
+    assert(strip_api_key(_REQUEST_URL + '&ApiKey=' + _API_KEY) == _REQUEST_URL)
+    assert(strip_api_key(_BASE_URL + '/wps?ApiKey={}&Request=Execute'.format(_API_KEY)) ==
+           _BASE_URL + '/wps?Request=Execute')
+
+
+def test_record_and_replay_submit(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'POLLING_PAUSE', 0)
+
+    path = tmpdir.join('job.cassette').strpath
+    csv = b'date,psl\n2075-01-16,101325\n'
+    live = FakeSession([
+        FakeResponse([_status_xml('ProcessAccepted', 'Accepted').encode('utf-8')]),
+        FakeResponse([_status_xml('ProcessStarted', 'Running').encode('utf-8')]),
+        FakeResponse([_status_xml('ProcessSucceeded', 'The End').encode('utf-8')]),
+        FakeResponse([csv]),
+    ])
+
+    # Record a full run: Execute request, two status polls and the download
+    cli = UKCPApiClient(outputs_dir=tmpdir.join('recorded').strpath, api_key=_API_KEY,
+                        session=RecordingSession(path, session=live))
+    cli.submit(_REQUEST_URL)
+
+    assert([record['url'] for record in _read_records(path)] ==
+           [_REQUEST_URL, _STATUS_URL, _STATUS_URL, _FILE_URL])
+
+    # Then replay it, without the live session
+    session = ReplaySession(path, speed=None)
+    cli = UKCPApiClient(outputs_dir=tmpdir.join('replayed').strpath, api_key=_API_KEY,
+                        session=session)
+
+    status, xml, outputs = cli.submit(_REQUEST_URL)
+
+    assert(status == 'ProcessSucceeded')
+    assert(xml == _status_xml('ProcessSucceeded', 'The End'))
+    assert(outputs == [tmpdir.join('replayed', 'subset.csv').strpath])
+
+    with open(outputs[0], 'rb') as output:
+        assert(output.read() == csv)
+
+
+def test_record_and_replay_download(tmpdir):
+    path = tmpdir.join('job.cassette').strpath
+    chunks = [b'date,psl\n', b'2075-01-16,101325\n']
+    live = FakeSession([FakeResponse(chunks, {'Content-Encoding': 'gzip'}, url=_FILE_URL)])
+
+    # Recording passes the body through chunk by chunk
+    events = []
+    save_url_to_local_file(_FILE_URL + '?ApiKey=' + _API_KEY, tmpdir.join('recorded.csv').strpath,
+                           callback=events.append, session=RecordingSession(path, session=live))
+    assert([event['bytes'] for event in events] == [9, 27])
+
+    records = _read_records(path)
+    assert(len(records) == 1)
+    assert(records[0]['url'] == _FILE_URL)
+    assert(records[0]['complete'])
+    assert(records[0]['headers'] == {'Content-Length': '27'})
+    assert('body' not in records[0])
+
+    target = tmpdir.join('replayed.csv').strpath
+    save_url_to_local_file(_FILE_URL, target, session=ReplaySession(path, speed=None))
+
+    with open(target, 'rb') as output:
+        assert(output.read() == b''.join(chunks))
+
+
+def test_record_too_large_xml(tmpdir):
+    path = tmpdir.join('job.cassette').strpath
+    chunks = [b'<a>', b'xxxx', b'xxxx', b'</a>'] + [b'x' * 1000] * 1000
+    live_response = FakeResponse(chunks, url=_STATUS_URL)
+
+    recording = RecordingSession(path, session=FakeSession([live_response]))
+
+    with pytest.raises(ResponseTooLarge):
+        read_xml_response(recording.get(_STATUS_URL, stream=True), max_size=8)
+
+    # The body stops being read (and recorded) at the size limit
+    record = _read_records(path)[0]
+    assert(not record['complete'])
+    assert(live_response.closed.is_set())
+    assert(os.path.getsize(tmpdir.join('job.cassette.bodies', record['body_file']).strpath) == 11)
+
+    # And it fails the same way on replay
+    with pytest.raises(ResponseTooLarge):
+        read_xml_response(ReplaySession(path, speed=None).get(_STATUS_URL), max_size=8)
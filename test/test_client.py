@@ -0,0 +1,108 @@
+import pytest
+
+from ukcp_api_client import utils
+from ukcp_api_client.client import UKCPApiClient
+from ukcp_api_client.utils import JobCancelled
+
+from test.fakes import FakeResponse, FakeSession
+
+
+_API_KEY = 'hGIG234234g7sNOHWLof982LOSHL34g7'
+_BASE_URL = 'https://ukclimateprojections-ui.metoffice.gov.uk'
+_STATUS_URL = _BASE_URL + '/status/4aa3b60afa489a11b9772c8a1d956625'
+_FILE_URL = _BASE_URL + '/dl/0/4aa3b60afa489a11b9772c8a1d956625/subset.csv'
+
+_URL_TEMPLATE = (_BASE_URL + '/wps?Request=Execute&Identifier={}&Format=text/xml&'
+                 'Inform=true&Store=false&Status=false&DataInputs={}')
+
+_MAPS_URL = _URL_TEMPLATE.format('LS1_Maps_01',
+    'TemporalAverage=jja;Baseline=b8100;Scenario=rcp45;'
+    'Area=bbox|-84667.14|-114260.00|676489.68|1230247.30;'
+    'SpatialSelectionType=bbox;TimeSliceDuration=20y;DataFormat=csv;'
+    'FontSize=m;Collection=land-prob;TimeSlice=2060-2079;'
+    'ShowBoundaries=country;Variable=prAnom;ImageSize=1200;ImageFormat=png')
+
+_SUBSET_URL = _URL_TEMPLATE.format('LS3_Subset_01',
+    'TemporalAverage=jan;Area=bbox|474459.24|241777.72|'
+    '486311.19|246518.35;Collection=land-rcm;ClimateChangeType=absolute;'
+    'EnsembleMemberSet=land-rcm;DataFormat=csv;TimeSlice=2075|2076;Variable=psl')
+
+_ERROR_XML = ('<ExceptionReport xmlns="http://www.opengis.net/ows/1.1"><Exception>'
+              '<ExceptionText>Identifier not found.</ExceptionText></Exception></ExceptionReport>')
+
+_EXECUTE_XML = ('<ExecuteResponse xmlns="http://www.opengeospatial.net/wps" '
+                'statusLocation="{}"/>'.format(_STATUS_URL))
+
+_SUCCEEDED_XML = ('<ExecuteResponse xmlns="http://www.opengeospatial.net/wps">'
+                  '<Status><ProcessSucceeded>The End</ProcessSucceeded></Status>'
+                  '<FileURL>{}</FileURL></ExecuteResponse>'.format(_FILE_URL))
+
+
+def _job_responses(csv=b'date,psl\n2075-01-16,101325\n'):
+    return [FakeResponse([_EXECUTE_XML.encode('utf-8')]),
+            FakeResponse([_SUCCEEDED_XML.encode('utf-8')]),
+            FakeResponse([csv])]
+
+
+def test_submit_all_runs_largest_first_and_continues_after_failure(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'POLLING_PAUSE', 0)
+
+    # The (cheaper) subset job is listed first, but the maps job runs first and fails
+    session = FakeSession([FakeResponse([_ERROR_XML.encode('utf-8')])] + _job_responses())
+    cli = UKCPApiClient(outputs_dir=tmpdir.strpath, api_key=_API_KEY, session=session)
+
+    results = cli.submit_all([_SUBSET_URL, _MAPS_URL])
+
+    assert([request_url for request_url, _, _ in results] == [_MAPS_URL, _SUBSET_URL])
+    assert(session.calls[0].startswith(_MAPS_URL))
+
+    assert(results[0][1] is None)
+    assert(str(results[0][2]) == 'Request failed: Identifier not found.')
+
+    status, _, outputs = results[1][1]
+    assert(status == 'ProcessSucceeded')
+    assert(outputs == [tmpdir.join('subset.csv').strpath])
+    assert(results[1][2] is None)
+
+
+def test_submit_all_shortest_first(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'POLLING_PAUSE', 0)
+
+    session = FakeSession(_job_responses() + [FakeResponse([_ERROR_XML.encode('utf-8')])])
+    cli = UKCPApiClient(outputs_dir=tmpdir.strpath, api_key=_API_KEY, session=session)
+
+    results = cli.submit_all([_MAPS_URL, _SUBSET_URL], strategy='shortest_first')
+
+    assert([request_url for request_url, _, _ in results] == [_SUBSET_URL, _MAPS_URL])
+    assert(session.calls[0].startswith(_SUBSET_URL))
+    assert(results[0][2] is None and results[1][1] is None)
+
+
+def test_submit_returns_outputs_when_indexing_fails(tmpdir, monkeypatch):
+    monkeypatch.setattr(utils, 'POLLING_PAUSE', 0)
+
+    # An empty CSV file cannot be indexed
+    session = FakeSession(_job_responses(csv=b''))
+    cli = UKCPApiClient(outputs_dir=tmpdir.strpath, api_key=_API_KEY, session=session,
+                        index_path=tmpdir.join('index.sqlite').strpath)
+
+    status, _, outputs = cli.submit(_SUBSET_URL)
+
+    assert(status == 'ProcessSucceeded')
+    assert(outputs == [tmpdir.join('subset.csv').strpath])
+    assert(cli._index.query('SELECT COUNT(*) FROM files') == [(0,)])
+    cli.close()
+
+
+def test_cancel_before_submit(tmpdir):
+    session = FakeSession([])
+    cli = UKCPApiClient(outputs_dir=tmpdir.strpath, api_key=_API_KEY, session=session)
+
+    cli.cancel()
+
+    with pytest.raises(JobCancelled):
+        cli.submit(_SUBSET_URL)
+
+    # Nothing was sent and the cancellation does not carry over to the next job
+    assert(session.calls == [])
+    assert(not cli._cancel_event.is_set())
@@ -0,0 +1,106 @@
+import threading
+
+from ukcp_api_client.index import CsvIndex
+
+
+_REQUEST_URL = ('https://ukclimateprojections-ui.metoffice.gov.uk/wps?'
+    'Request=Execute&Identifier=LS3_Subset_01&Format=text/xml&Inform=true&Store=false&'
+    'Status=false&DataInputs=TemporalAverage={};Area=bbox|474459.24|241777.72|'
+    '486311.19|246518.35;Collection=land-rcm;ClimateChangeType=absolute;'
+    'EnsembleMemberSet=land-rcm;DataFormat=csv;TimeSlice=2075|2076;Variable=psl')
+
+_AREA = 'bbox|474459.24|241777.72|486311.19|246518.35'
+
+_CSV = """Variable,psl
+Date,Ensemble member,Value
+2075-01-16,01,{}
+2075-01-16,04,{}
+
+2076-01-16,01,{}
+"""
+
+_GRID_CSV = """Date,projection_x_coordinate,projection_y_coordinate,Value
+2075-07-16,474459.24,241777.72,1.5
+2075-07-16,486311.19,241777.72,2.5
+"""
+
+
+def _write_csv(tmpdir, name, content):
+    p = tmpdir.join(name)
+    p.write(content)
+    return p.strpath
+
+
+def test_add_csv(tmpdir):
+    index = CsvIndex(tmpdir.join('index.sqlite').strpath)
+
+    index.add_csv(_write_csv(tmpdir, 'jan.csv', _CSV.format(1010.5, 1011.0, 1012.5)),
+                  request_url=_REQUEST_URL.format('jan'))
+
+    rows = index.lookup(date_to='2075-12', location=_AREA)
+    assert([row[1:] for row in rows] == [
+        (0, '2075-01-16', _AREA, 'Ensemble member', '01', 1.0),
+        (0, '2075-01-16', _AREA, 'Value', '1010.5', 1010.5),
+        (1, '2075-01-16', _AREA, 'Ensemble member', '04', 4.0),
+        (1, '2075-01-16', _AREA, 'Value', '1011.0', 1011.0),
+    ])
+
+
+def test_lookup_across_files(tmpdir):
+    index = CsvIndex(tmpdir.join('index.sqlite').strpath)
+
+    jan = index.add_csv(_write_csv(tmpdir, 'jan.csv', _CSV.format(1, 2, 3)),
+                        request_url=_REQUEST_URL.format('jan'))
+    jja = index.add_csv(_write_csv(tmpdir, 'jja.csv', _GRID_CSV),
+                        request_url=_REQUEST_URL.format('jja'))
+
+    assert(index.find_files(TemporalAverage='jja') == [jja])
+    assert(index.find_files(Variable='psl') == [jan, jja])
+
+    # One query across all files
+    rows = index.lookup(date_from='2075-01', date_to='2075-08', column_name='Value')
+    assert([(row[2], row[3], row[6]) for row in rows] == [
+        ('2075-01-16', _AREA, 1.0),
+        ('2075-01-16', _AREA, 2.0),
+        ('2075-07-16', '474459.24|241777.72', 1.5),
+        ('2075-07-16', '486311.19|241777.72', 2.5),
+    ])
+
+    rows = index.lookup(location='486311.19|241777.72', TemporalAverage='jja')
+    assert([row[5] for row in rows] == ['2.5'])
+
+    # Re-adding a file replaces it
+    index.add_csv(_write_csv(tmpdir, 'jan.csv', _CSV.format(7, 8, 9)),
+                  request_url=_REQUEST_URL.format('jan'))
+    rows = index.lookup(column_name='Value', TemporalAverage='jan')
+    assert([row[6] for row in rows] == [7.0, 8.0, 9.0])
+
+
+def test_add_csv_from_another_thread(tmpdir):
+    index = CsvIndex(tmpdir.join('index.sqlite').strpath)
+    errors = []
+
+    def _add():
+        try:
+            index.add_csv(_write_csv(tmpdir, 'jan.csv', _CSV.format(1, 2, 3)))
+        except Exception as err:
+            errors.append(err)
+
+    thread = threading.Thread(target=_add)
+    thread.start()
+    thread.join()
+
+    assert(errors == [])
+    assert(len(index.lookup(column_name='Value')) == 3)
+    index.close()
+
+
+def test_add_csv_reads_utf8_and_quoted_newlines(tmpdir):
+    p = tmpdir.join('jja.csv')
+    p.write_binary(u'Date,Units,Value\r\n2075-07-16,"\u00b0C\r\nmean",1.5\r\n'.encode('utf-8'))
+
+    index = CsvIndex(tmpdir.join('index.sqlite').strpath)
+    index.add_csv(p.strpath)
+
+    rows = index.lookup(column_name='Units')
+    assert([row[5] for row in rows] == [u'\u00b0C\r\nmean'])
@@ -0,0 +1,122 @@
+import time
+
+import pytest
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from ukcp_api_client.mirrors import MirrorSession
+
+from test.fakes import FakeResponse, FakeSession
+
+
+_SERVICE_URL = 'https://ukclimateprojections-ui.metoffice.gov.uk'
+_MIRROR_URL = 'http://mirror.example.org'
+_PROXY_URL = 'http://localhost:8080'
+_STATUS_PATH = '/status/4aa3b60afa489a11b9772c8a1d956625'
+_EXECUTE_PATH = '/wps?Request=Execute&Identifier=LS3_Subset_01'
+
+
+def _fake_session(behaviour):
+    """
+    Returns a FakeSession that responds to each base URL with the given
+    (delay, status_code); a status_code of None raises a ConnectionError
+    (as for a refused connection) and an exception class is raised.
+    """
+    def _respond(url):
+        base_url = next(base for base in behaviour if url.startswith(base))
+        delay, status_code = behaviour[base_url]
+
+        time.sleep(delay)
+
+        if status_code is None:
+            raise requests.ConnectionError(NewConnectionError(None, 'Cannot connect to: {}'
+                                                              .format(base_url)))
+
+        if isinstance(status_code, type):
+            raise status_code('Error from: {}'.format(base_url))
+
+        return FakeResponse(url=url, status_code=status_code)
+
+    return FakeSession(_respond)
+
+
+def test_get_urls():
+    session = MirrorSession([_MIRROR_URL, _PROXY_URL])
+
+    assert(session.get_urls(_SERVICE_URL + _STATUS_PATH) ==
+           [_MIRROR_URL + _STATUS_PATH, _PROXY_URL + _STATUS_PATH])
+    assert(session.get_urls(_PROXY_URL + _STATUS_PATH) ==
+           [_MIRROR_URL + _STATUS_PATH, _PROXY_URL + _STATUS_PATH])
+    assert(session.get_urls('http://other.org/file.csv') == ['http://other.org/file.csv'])
+
+
+def test_fail_over():
+    fake = _fake_session({_SERVICE_URL: (0, None), _MIRROR_URL: (0, 503), _PROXY_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL, _PROXY_URL], session=fake)
+
+    response = session.get(_SERVICE_URL + _STATUS_PATH)
+
+    assert(response.url == _PROXY_URL + _STATUS_PATH)
+    assert(len(fake.calls) == 3)
+
+
+def test_execute_not_retried_on_server_error():
+    fake = _fake_session({_SERVICE_URL: (0, 503), _MIRROR_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL], hedge_after=0.01, session=fake)
+
+    response = session.get(_SERVICE_URL + _EXECUTE_PATH)
+
+    assert(response.status_code == 503)
+    assert(fake.calls == [_SERVICE_URL + _EXECUTE_PATH])
+
+
+def test_execute_fails_over_before_sent():
+    fake = _fake_session({_SERVICE_URL: (0, None), _MIRROR_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL], session=fake)
+
+    response = session.get(_SERVICE_URL + _EXECUTE_PATH)
+
+    assert(response.url == _MIRROR_URL + _EXECUTE_PATH)
+
+
+@pytest.mark.parametrize('error', [requests.ReadTimeout, requests.exceptions.ChunkedEncodingError,
+                                   requests.ConnectionError])
+def test_execute_not_retried_after_sent(error):
+    fake = _fake_session({_SERVICE_URL: (0, error), _MIRROR_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL], session=fake)
+
+    with pytest.raises(error):
+        session.get(_SERVICE_URL + _EXECUTE_PATH)
+
+    assert(fake.calls == [_SERVICE_URL + _EXECUTE_PATH])
+
+
+def test_status_retried_after_read_timeout():
+    fake = _fake_session({_SERVICE_URL: (0, requests.ReadTimeout), _MIRROR_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL], session=fake)
+
+    response = session.get(_SERVICE_URL + _STATUS_PATH)
+
+    assert(response.url == _MIRROR_URL + _STATUS_PATH)
+
+
+def test_hedge():
+    fake = _fake_session({_SERVICE_URL: (0.5, 200), _MIRROR_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL], hedge_after=0.05, session=fake)
+
+    response = session.get(_SERVICE_URL + _STATUS_PATH)
+    assert(response.url == _MIRROR_URL + _STATUS_PATH)
+
+    # The slow response is discarded when it arrives
+    time.sleep(0.6)
+    assert([r.closed.is_set() for r in fake.returned] == [False, True])
+
+
+def test_no_hedge_when_fast():
+    fake = _fake_session({_SERVICE_URL: (0, 200), _MIRROR_URL: (0, 200)})
+    session = MirrorSession([_SERVICE_URL, _MIRROR_URL], hedge_after=0.5, session=fake)
+
+    response = session.get(_SERVICE_URL + _STATUS_PATH)
+
+    assert(response.url == _SERVICE_URL + _STATUS_PATH)
+    assert(len(fake.calls) == 1)
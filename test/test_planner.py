@@ -0,0 +1,52 @@
+from ukcp_api_client.planner import (parse_data_inputs, estimate_cost,
+        order_requests, pack_requests)
+
+
+_URL_TEMPLATE = ('https://ukclimateprojections-ui.metoffice.gov.uk/wps?'
+    'Request=Execute&Identifier={}&Format=text/xml&Inform=true&Store=false&'
+    'Status=false&DataInputs={}')
+
+_PLUME_URL = _URL_TEMPLATE.format('LS1_Plume_01',
+    'Area=point|245333.38|778933.24;Baseline=b8100;'
+    'Collection=land-prob;ColourMode=c;DataFormat=csv;FontSize=m;'
+    'ImageFormat=png;ImageSize=1200;LegendPosition=7;PlotType=PDF_PLOT;'
+    'Scenario=sres-a1b;TemporalAverage=jan;TimeSlice=2050-2069;'
+    'TimeSliceDuration=20y;Variable=tasAnom')
+
+_MAPS_URL = _URL_TEMPLATE.format('LS1_Maps_01',
+    'TemporalAverage=jja;Baseline=b8100;Scenario=rcp45;'
+    'Area=bbox|-84667.14|-114260.00|676489.68|1230247.30;'
+    'SpatialSelectionType=bbox;TimeSliceDuration=20y;DataFormat=csv;'
+    'FontSize=m;Collection=land-prob;TimeSlice=2060-2079;'
+    'ShowBoundaries=country;Variable=prAnom;ImageSize=1200;ImageFormat=png')
+
+_SUBSET_URL = _URL_TEMPLATE.format('LS3_Subset_01',
+    'TemporalAverage=jan;Area=bbox|474459.24|241777.72|'
+    '486311.19|246518.35;Collection=land-rcm;ClimateChangeType=absolute;'
+    'EnsembleMemberSet=land-rcm;DataFormat=csv;TimeSlice=2075|2076;Variable=psl')
+
+
+def test_parse_data_inputs():
+    data_inputs = parse_data_inputs(_SUBSET_URL)
+
+    assert(data_inputs['Collection'] == 'land-rcm')
+    assert(data_inputs['TimeSlice'] == '2075|2076')
+    assert(data_inputs['Area'] == 'bbox|474459.24|241777.72|486311.19|246518.35')
+
+
+def test_estimate_cost():
+    assert(estimate_cost(_SUBSET_URL) < estimate_cost(_PLUME_URL) < estimate_cost(_MAPS_URL))
+
+
+def test_order_requests():
+    urls = [_MAPS_URL, _SUBSET_URL, _PLUME_URL]
+
+    assert(order_requests(urls) == [_SUBSET_URL, _PLUME_URL, _MAPS_URL])
+    assert(order_requests(urls, strategy='largest_first') == [_MAPS_URL, _PLUME_URL, _SUBSET_URL])
+
+
+def test_pack_requests():
+    queues = pack_requests([_PLUME_URL, _SUBSET_URL, _MAPS_URL, _PLUME_URL], 2)
+
+    assert(queues[0] == [_MAPS_URL])
+    assert(sorted(queues[1]) == sorted([_PLUME_URL, _PLUME_URL, _SUBSET_URL]))
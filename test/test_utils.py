@@ -0,0 +1,175 @@
+import os
+import threading
+
+import pytest
+
+from ukcp_api_client import utils
+from ukcp_api_client.utils import (save_url_to_local_file, poll_until_ready,
+        read_xml_response, decode_xml, CancelEvent, JobCancelled, ResponseTooLarge)
+
+from test.fakes import FakeResponse, FakeSession
+
+
+_API_KEY = 'hGIG234234g7sNOHWLof982LOSHL34g7'
+_FILE_URL = 'https://ukclimateprojections-ui.metoffice.gov.uk/dl/0/4aa3b60afa489a11b9772c8a1d956625/subset.csv'
+_STATUS_URL = 'https://ukclimateprojections-ui.metoffice.gov.uk/status/4aa3b60afa489a11b9772c8a1d956625'
+
+_STATUS_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ExecuteResponse xmlns="http://www.opengeospatial.net/wps" version="1.0.0">
+	<Status>
+			<{0} percentCompleted="{1}">Message</{0}>
+	</Status>
+</ExecuteResponse>"""
+
+
+def test_download_progress(tmpdir):
+    target = tmpdir.join('subset.csv').strpath
+    session = FakeSession([FakeResponse([b'abc', b'de'], headers={'Content-Length': '5'})])
+    events = []
+
+    save_url_to_local_file(_FILE_URL, target, callback=events.append, session=session)
+
+    assert([(e['event'], e['bytes'], e['total']) for e in events] ==
+           [('download', 3, 5), ('download', 5, 5)])
+    assert(open(target, 'rb').read() == b'abcde')
+
+
+def test_download_event_url_has_no_api_key(tmpdir):
+    session = FakeSession([FakeResponse([b'abc'])])
+    events = []
+
+    save_url_to_local_file(_FILE_URL + '?ApiKey=' + _API_KEY, tmpdir.join('subset.csv').strpath,
+                           callback=events.append, session=session)
+
+    assert(session.calls == [_FILE_URL + '?ApiKey=' + _API_KEY])
+    assert([e['url'] for e in events] == [_FILE_URL])
+
+
+def test_incomplete_download(tmpdir):
+    target = tmpdir.join('subset.csv').strpath
+    session = FakeSession([FakeResponse([b'abc'], headers={'Content-Length': '5'})])
+
+    with pytest.raises(Exception) as err:
+        save_url_to_local_file(_FILE_URL, target, session=session)
+
+    assert('received 3 of 5 bytes' in str(err.value))
+    assert(not os.path.exists(target))
+
+
+def test_download_cancelled_mid_stream(tmpdir):
+    target = tmpdir.join('subset.csv').strpath
+    cancel_event = threading.Event()
+
+    def _cancel_on_second_chunk(i):
+        if i == 1:
+            cancel_event.set()
+
+    session = FakeSession([FakeResponse([b'abc', b'de', b'fg'], on_chunk=_cancel_on_second_chunk)])
+
+    with pytest.raises(JobCancelled):
+        save_url_to_local_file(_FILE_URL, target, cancel_event=cancel_event, session=session)
+
+    assert(not os.path.exists(target))
+
+
+def test_download_cancelled_before_first_chunk(tmpdir):
+    target = tmpdir.join('subset.csv').strpath
+    cancel_event = CancelEvent()
+    response = FakeResponse([b'abc'])
+
+    # Cancelled after the request is made, so the response is closed as soon
+    # as it is tracked and yields no data
+    session = FakeSession([response], on_get=lambda url: cancel_event.set())
+
+    with pytest.raises(JobCancelled):
+        save_url_to_local_file(_FILE_URL, target, cancel_event=cancel_event, session=session)
+
+    assert(response.closed.is_set())
+    assert(not os.path.exists(target))
+
+
+def test_stalled_download_is_aborted(tmpdir):
+    target = tmpdir.join('subset.csv').strpath
+    cancel_event = CancelEvent()
+    response = FakeResponse([b'abc'], stall=True)
+
+    # Cancel from another thread once the download is waiting for data
+    def _cancel_later(i):
+        threading.Timer(0.1, cancel_event.set).start()
+
+    response.on_chunk = _cancel_later
+
+    with pytest.raises(JobCancelled):
+        save_url_to_local_file(_FILE_URL, target, cancel_event=cancel_event,
+                               session=FakeSession([response]))
+
+    assert(response.closed.is_set())
+    assert(not os.path.exists(target))
+
+
+def test_poll_progress(monkeypatch):
+    monkeypatch.setattr(utils, 'POLLING_PAUSE', 0)
+
+    session = FakeSession([
+        FakeResponse([_STATUS_XML.format('ProcessStarted', 40).encode('utf-8')]),
+        FakeResponse([_STATUS_XML.format('ProcessSucceeded', 100).encode('utf-8')]),
+    ])
+    events = []
+
+    status, _ = poll_until_ready(_STATUS_URL, callback=events.append, session=session)
+
+    assert(status == 'ProcessSucceeded')
+    assert([(e['status'], e['percent_completed']) for e in events] ==
+           [('ProcessStarted', 40), ('ProcessSucceeded', 100)])
+
+
+def test_read_xml_response():
+    response = FakeResponse([b'<a>', b'</a>'], headers={'Content-Length': '7'})
+
+    assert(read_xml_response(response, max_size=7) == b'<a></a>')
+    assert(response.closed.is_set())
+
+
+def test_read_xml_response_content_length_too_large():
+    response = FakeResponse([b'<a>', b'</a>'], headers={'Content-Length': '7'})
+
+    # Rejected from the header, before any of the body is read
+    response.on_chunk = lambda i: pytest.fail('Body should not be read')
+
+    with pytest.raises(ResponseTooLarge):
+        read_xml_response(response, max_size=6)
+
+    assert(response.closed.is_set())
+
+
+def test_read_xml_response_streamed_too_large():
+    chunks_read = []
+    response = FakeResponse([b'<a>', b'xxxx', b'xxxx', b'</a>'], on_chunk=chunks_read.append)
+
+    with pytest.raises(ResponseTooLarge):
+        read_xml_response(response, max_size=8)
+
+    # Reading stops at the first chunk over the limit
+    assert(chunks_read == [0, 1, 2])
+    assert(response.closed.is_set())
+
+
+def test_decode_xml():
+    latin_xml = '<?xml version="1.0" encoding="ISO-8859-1"?><a>caf\xe9</a>'
+
+    assert(decode_xml(latin_xml.encode('latin-1')) == latin_xml)
+    assert(decode_xml(u'<a>caf\xe9</a>'.encode('latin-1'), 'text/xml; charset=ISO-8859-1') ==
+           u'<a>caf\xe9</a>')
+    assert(decode_xml(u'\ufeff<a>caf\xe9</a>'.encode('utf-8')) == u'<a>caf\xe9</a>')
+
+
+def test_poll_returns_declared_encoding(monkeypatch):
+    monkeypatch.setattr(utils, 'POLLING_PAUSE', 0)
+
+    xml = _STATUS_XML.format('ProcessSucceeded', 100).replace('UTF-8', 'ISO-8859-1')
+    xml = xml.replace('Message', u'Termin\xe9')
+    session = FakeSession([FakeResponse([xml.encode('latin-1')])])
+
+    _, returned = poll_until_ready(_STATUS_URL, session=session)
+
+    assert(returned == xml)
@@ -227,3 +227,18 @@ def test_get_zip_file_url(tmpdir):
     zip_file_url = _get_zip_file_url(p.strpath)
 
     assert(zip_file_url == 'https://ukclimateprojections-ui.metoffice.gov.uk/dl/0/4aa3b60afa489a11b9772c8a1d956625/output_4aa3b60afa489a11b9772c8a1d956625_20190305_085707.zip')
+
+
+_STARTED_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<ExecuteResponse xmlns="http://www.opengeospatial.net/wps" statusLocation="https://ukclimateprojections-ui.metoffice.gov.uk/status/4aa3b60afa489a11b9772c8a1d956625" version="1.0.0">
+	<Status>
+			<ProcessStarted percentCompleted="40">Running</ProcessStarted>
+	</Status>
+</ExecuteResponse>"""
+
+
+def test_get_percent_completed():
+    from ukcp_api_client.utils import get_percent_completed
+
+    assert(get_percent_completed(_STARTED_XML) == 40)
+    assert(get_percent_completed(_XML) is None)
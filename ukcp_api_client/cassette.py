@@ -0,0 +1,295 @@
+"""
+cassette.py
+===========
+
+Sessions that record HTTP exchanges to a cassette file, or replay them from one,
+so that the client can be run and profiled without network access.
+
+Usage:
+>>> from ukcp_api_client.cassette import RecordingSession, ReplaySession
+>>> cli = UKCPApiClient(api_key=api_key, session=RecordingSession('job.cassette'))
+>>> cli.submit(request_url)
+
+>>> cli = UKCPApiClient(api_key=api_key, session=ReplaySession('job.cassette', speed=10))
+>>> cli.submit(request_url)
+
+A cassette is a file of JSON lines, one per exchange (Execute request, status poll
+or file download), holding the URL (API Key removed), status code, headers and the
+time taken. Response bodies are written, as they are read, to files in the
+directory `<cassette>.bodies`, so recording and replaying do not hold them in
+memory. Exchanges for the same URL are replayed in the order they were recorded.
+
+Note that the client also pauses for `utils.POLLING_PAUSE` seconds between status
+polls; set it to 0 to replay as fast as possible.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from ukcp_api_client.utils import strip_api_key
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+CHUNK_SIZE = 64 * 1024
+IGNORED_HEADERS = ('content-encoding', 'transfer-encoding', 'content-length')
+
+
+class RecordingResponse(object):
+    """
+    Wraps a streamed response. Chunks are written to a body file as the caller
+    reads them, and the exchange is added to the cassette when the response has
+    been read in full or closed.
+    """
+
+    def __init__(self, session, url, response, body_name, start, headers_elapsed):
+        self.url = url
+        self.status_code = response.status_code
+        self.raw = getattr(response, 'raw', None)
+
+        # Body is stored decoded, so drop transfer headers that no longer apply
+        self.headers = CaseInsensitiveDict(response.headers)
+        self._headers = dict((key, value) for key, value in response.headers.items()
+                             if key.lower() not in IGNORED_HEADERS)
+        self._content_length = response.headers.get('Content-Length')
+
+        self._session = session
+        self._response = response
+        self._body_name = body_name
+        self._start = start
+        self._headers_elapsed = headers_elapsed
+        self._size = 0
+        self._finished = False
+
+    @property
+    def content(self):
+        return b''.join(self.iter_content())
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        body_path = self._session.get_body_path(self._body_name)
+
+        with open(body_path, 'ab') as body_file:
+            for chunk in self._response.iter_content(chunk_size=chunk_size):
+                body_file.write(chunk)
+                self._size += len(chunk)
+                yield chunk
+
+        self._finish(complete=True)
+
+    def close(self):
+        self._response.close()
+        self._finish(complete=False)
+
+    def _finish(self, complete):
+        """
+        Adds the exchange to the cassette (only once).
+
+        :param complete: Whether the whole body was read [Boolean]
+        :return: None
+        """
+        if self._finished:
+            return
+
+        self._finished = True
+        headers = dict(self._headers)
+
+        # Keep the original length if the body was not read in full,
+        # so that a size check on replay sees the same response
+        if complete:
+            headers['Content-Length'] = str(self._size)
+        elif self._content_length is not None:
+            headers['Content-Length'] = self._content_length
+
+        self._session.write_record({
+            'url': strip_api_key(self.url),
+            'status_code': self.status_code,
+            'headers': headers,
+            'body_file': self._body_name,
+            'complete': complete,
+            'elapsed_headers': self._headers_elapsed,
+            'elapsed': time.time() - self._start,
+        })
+
+
+class RecordingSession(object):
+    """
+    Session that makes real HTTP requests and appends each exchange to the
+    cassette file at `path`.
+    """
+
+    def __init__(self, path, session=None):
+        """
+        :param path: Cassette file path (overwritten, with its bodies directory) [String]
+        :param session: Object used to make each request, providing
+                        `get(url, **kwargs)` (default: `requests`)
+        """
+        self._path = path
+        self._bodies_dir = path + '.bodies'
+        self._session = session or requests
+        self._lock = threading.Lock()
+        self._count = 0
+
+        open(self._path, 'w').close()
+
+        if os.path.isdir(self._bodies_dir):
+            shutil.rmtree(self._bodies_dir)
+        os.makedirs(self._bodies_dir)
+
+    def get_body_path(self, body_name):
+        """
+        Returns the path of the body file called `body_name`.
+
+        :param body_name: Body file name [String]
+        :return: Body file path [String]
+        """
+        return os.path.join(self._bodies_dir, body_name)
+
+    def write_record(self, record):
+        """
+        Appends `record` to the cassette file.
+
+        :param record: Exchange details [dict]
+        :return: None
+        """
+        with self._lock:
+            with open(self._path, 'a') as cassette:
+                cassette.write(json.dumps(record) + '\n')
+
+        log.debug('Recorded: %s (%.3f seconds)', record['url'], record['elapsed'])
+
+    def get(self, url, **kwargs):
+        """
+        Makes a GET request and returns a response that is recorded as it is read.
+
+        :param url: URL [String]
+        :return: RecordingResponse
+        """
+        with self._lock:
+            self._count += 1
+            body_name = '{:06d}.body'.format(self._count)
+
+        # Create the body file now, so that an empty or unread body still has one
+        open(self.get_body_path(body_name), 'wb').close()
+
+        start = time.time()
+        response = self._session.get(url, **kwargs)
+
+        return RecordingResponse(self, url, response, body_name, start, time.time() - start)
+
+
+class CassetteResponse(object):
+    """
+    Response-like object serving a recorded exchange.
+    Provides the parts of the `requests.Response` interface used by the client.
+    """
+
+    def __init__(self, url, status_code, headers, body_path, complete=True, chunk_delay=None):
+        """
+        :param url: URL [String]
+        :param status_code: HTTP status code [int]
+        :param headers: Response headers [dict]
+        :param body_path: Path of the body file [String]
+        :param complete: If False, an IOError is raised after the body is read [Boolean]
+        :param chunk_delay: Function of chunk size returning seconds to pause per chunk
+        """
+        self.url = url
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers)
+        self._body_path = body_path
+        self._complete = complete
+        self._chunk_delay = chunk_delay
+
+    @property
+    def content(self):
+        return b''.join(self.iter_content())
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        with open(self._body_path, 'rb') as body_file:
+            for chunk in iter(lambda: body_file.read(chunk_size), b''):
+                if self._chunk_delay:
+                    time.sleep(self._chunk_delay(len(chunk)))
+                yield chunk
+
+        if not self._complete:
+            raise IOError('Recorded response for {} was not read in full.'.format(self.url))
+
+    def close(self):
+        pass
+
+
+class ReplaySession(object):
+    """
+    Session that serves responses from the cassette file at `path` instead of
+    making HTTP requests. Responses are delayed by their recorded timings divided
+    by `speed` (use `speed=None` for no delay).
+    """
+
+    def __init__(self, path, speed=1.0):
+        """
+        :param path: Cassette file path [String]
+        :param speed: Replay speed relative to recorded timings [float or None]
+        """
+        self._bodies_dir = path + '.bodies'
+        self._speed = speed
+        self._lock = threading.Lock()
+        self._exchanges = {}
+
+        with open(path) as cassette:
+            for line in cassette:
+                if not line.strip():
+                    continue
+
+                record = json.loads(line)
+                self._exchanges.setdefault(record['url'], []).append(record)
+
+    def get(self, url, **kwargs):
+        """
+        Returns the next recorded response for `url`.
+        Raises Exception if `url` is not in the cassette.
+
+        :param url: URL [String]
+        :return: CassetteResponse
+        """
+        key = strip_api_key(url)
+
+        with self._lock:
+            records = self._exchanges.get(key)
+
+            if not records:
+                raise Exception('No recorded response left in cassette for: {}'.format(key))
+
+            # Keep repeating the last response (e.g. extra status polls)
+            record = records.pop(0) if len(records) > 1 else records[0]
+
+        elapsed = record['elapsed']
+        headers_elapsed = record['elapsed_headers']
+        body_path = os.path.join(self._bodies_dir, record['body_file'])
+        size = os.path.getsize(body_path)
+        chunk_delay = None
+
+        if self._speed:
+            time.sleep(headers_elapsed / self._speed)
+
+            # Spread the time spent reading the body over its chunks
+            body_elapsed = max(0, elapsed - headers_elapsed)
+            if body_elapsed and size:
+                chunk_delay = lambda length: body_elapsed * length / size / self._speed
+
+        return CassetteResponse(url, record['status_code'], record['headers'], body_path,
+                                complete=record['complete'], chunk_delay=chunk_delay)
@@ -16,7 +16,10 @@ log.setLevel(logging.INFO)
 
 from ukcp_api_client.utils import (validate_api_key, get_status_url,
         poll_until_ready, get_status_and_message, get_file_urls,
-        save_url_to_local_file, FAILED_STATUS)
+        save_url_to_local_file, read_xml_response, FAILED_STATUS, JobCancelled,
+        CancelEvent)
+from ukcp_api_client.planner import order_requests
+from ukcp_api_client.index import CsvIndex
 
 
 class UKCPApiClient(object):
@@ -34,19 +37,38 @@ class UKCPApiClient(object):
     >>> file_urls = cli.submit(request_url)
     """
 
-    def __init__(self, outputs_dir='/tmp', api_key=None):
+    def __init__(self, outputs_dir='/tmp', api_key=None, progress_callback=None,
+                 session=None, index_path=None):
         """
         Constructor for UKCPApiClient class:
         Takes inputs and saves the settings for:
 
         - outputs_dir
         - api_key
+        - progress_callback
+        - session
+        - index_path
+
+        The progress callback is called with a dictionary for each event:
+
+        - {'event': 'status', 'status': ..., 'percent_completed': ...}
+        - {'event': 'download', 'url': ..., 'target': ..., 'bytes': ..., 'total': ...}
 
         :param outputs_dir: Output directory to write outputs [directory path]
         :param api_key: API Key [string]
+        :param progress_callback: Function called with progress events [callable]
+        :param session: Object used to make HTTP requests, providing `get(url, **kwargs)`.
+                        Defaults to the `requests` module. See `ukcp_api_client.cassette`
+                        for sessions that record or replay HTTP exchanges.
+        :param index_path: If set, CSV outputs are loaded into a local SQLite index
+                           at this path (see `ukcp_api_client.index`) [file path]
         """
         self._api_key = None
         self._outputs_dir = None
+        self._progress_callback = progress_callback
+        self._cancel_event = CancelEvent()
+        self._session = session or requests
+        self._index = CsvIndex(index_path) if index_path else None
 
         self.set_api_key(api_key)
         self.set_outputs_dir(outputs_dir)
@@ -81,6 +103,28 @@ class UKCPApiClient(object):
 
         self._outputs_dir = outputs_dir
 
+    def close(self):
+        """
+        Releases resources held by the client (the local CSV index, if one is used).
+
+        :return: None
+        """
+        if self._index:
+            self._index.close()
+            self._index = None
+
+    def cancel(self):
+        """
+        Cancels the job currently being run by `submit` (e.g. from another thread).
+        Polling stops, in-flight status and download responses are aborted and
+        partial files are removed. `submit` then raises JobCancelled.
+        If no job is running, the next call to `submit` is cancelled instead.
+
+        :return: None
+        """
+        log.info('Cancelling job...')
+        self._cancel_event.set()
+
     def submit(self, request_url, outputs_dir=None):
         """
         Method for submitting a request to the UKCP API.
@@ -104,25 +148,63 @@ class UKCPApiClient(object):
         if outputs_dir:
             self.set_outputs_dir(outputs_dir)
 
-        # Submit request and get Execute Response XML doc
-        log.info('Submitting request with URL: {}'.format(request_url))
-        response = requests.get(request_url)
+        try:
+            if self._cancel_event.is_set():
+                raise JobCancelled('Job was cancelled before it was submitted.')
+
+            # Submit request and get Execute Response XML doc
+            log.info('Submitting request with URL: {}'.format(request_url))
+            response = self._session.get(request_url, stream=True)
 
-        # Get status URL
-        status_url = get_status_url(response.text)
+            # Get status URL (body is read with a size limit and parsed as bytes)
+            status_url = get_status_url(read_xml_response(response))
 
-        # Poll until a known status is found
-        status, xml = poll_until_ready(status_url)
+            # Poll until a known status is found
+            status, xml = poll_until_ready(status_url, callback=self._progress_callback,
+                                           cancel_event=self._cancel_event,
+                                           session=self._session)
 
-        # Respond to failure if it failed
-        if status == FAILED_STATUS:
-            return self._respond_to_failure(xml, request_url)
+            # Respond to failure if it failed
+            if status == FAILED_STATUS:
+                return self._respond_to_failure(xml, request_url)
 
-        # Save the outputs
-        output_files = self._save_outputs(xml)
+            # Save the outputs
+            output_files = self._save_outputs(xml, request_url)
+        finally:
+            # A cancellation only applies to one job
+            self._cancel_event.clear()
 
         return status, xml, output_files
 
+    def submit_all(self, request_urls, strategy='largest_first'):
+        """
+        Submits a batch of requests one after another, in the order given by
+        their estimated cost (see `ukcp_api_client.planner`).
+        By default the most expensive requests run first, so that a long job
+        (e.g. a map over the whole UK) is not left to start at the end of the
+        batch; use 'shortest_first' to get the most results back soonest.
+        A request that fails does not stop the batch.
+        Returns a list of (<request_url>, <result>, <error>) tuples in the order
+        they were run, where:
+
+        <result> - is the tuple returned by `submit` (None if the request failed).
+        <error> - is the exception raised by `submit` (None if the request succeeded).
+
+        :param request_urls: List of UKCP API Request URLs
+        :param strategy: 'shortest_first' or 'largest_first' [String]
+        :return: List of (request_url, (status, response, outputs), error)
+        """
+        results = []
+
+        for request_url in order_requests(request_urls, strategy=strategy):
+            try:
+                results.append((request_url, self.submit(request_url), None))
+            except Exception as err:
+                log.error('Request failed, continuing with batch: {}'.format(err))
+                results.append((request_url, None, err))
+
+        return results
+
     def _respond_to_failure(self, xml, request_url):
         """
         Provide some output information when job has failed.
@@ -135,11 +217,14 @@ class UKCPApiClient(object):
         raise Exception('Failed to process request: {}\nThe process failed with error message: "{}"'
                         .format(request_url, message))
 
-    def _save_outputs(self, xml):
+    def _save_outputs(self, xml, request_url=None):
         """
         Download the output files and save them to the specified outputs directory.
+        CSV files are also added to the local index, if one is in use (a file
+        that cannot be indexed is logged and skipped).
 
         :param xml: XML Response Document [String]
+        :param request_url: UKCP Request URL [String]
         :return: List of local output file paths
         """
         file_urls = get_file_urls(xml)
@@ -162,7 +247,15 @@ class UKCPApiClient(object):
             full_url = '{}?ApiKey={}'.format(url, self._api_key)
 
             log.info("  - {}".format(target))
-            save_url_to_local_file(full_url, target)
+            save_url_to_local_file(full_url, target, callback=self._progress_callback,
+                                   cancel_event=self._cancel_event,
+                                   session=self._session)
+
+            if self._index and target.endswith('.csv'):
+                try:
+                    self._index.add_csv(target, request_url=request_url)
+                except Exception as err:
+                    log.warning('Could not index {}: {}'.format(target, err))
 
             outputs.append(target)
 
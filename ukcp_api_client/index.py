@@ -0,0 +1,320 @@
+"""
+index.py
+========
+
+Holds the CsvIndex class: a local SQLite database into which downloaded CSV
+outputs are loaded, so that they can be queried without re-reading every file.
+
+Usage:
+>>> from ukcp_api_client.index import CsvIndex
+>>> index = CsvIndex('outputs.sqlite')
+>>> index.add_csv('my-outputs/subset.csv', request_url=request_url)
+>>> rows = index.lookup(date_from='2075-06', date_to='2075-09', TemporalAverage='jja')
+
+All CSV files are stored in a single `data` table with one row per value:
+
+- file_id: id of the file in the `files` table (which also holds its path and
+  the `DataInputs` of the request that produced it)
+- row_index: number of the data row in the CSV file
+- date: value of the date/time column of the row (if any)
+- location: value(s) of the location columns of the row joined with "|", or
+  else the `Area` of the request (e.g. "point|245333.38|778933.24")
+- column_name: name of the CSV column
+- value: the value as text, exactly as in the CSV file
+- number: the value as a number (NULL if it is not numeric)
+
+The table is indexed on (date), (location, date) and (file_id), so point and
+time-range lookups across all files use a single query.
+"""
+
+import io
+import os
+import re
+import csv
+import json
+import logging
+import sqlite3
+import threading
+
+from ukcp_api_client.planner import parse_data_inputs
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+# Number of leading rows searched for the header (the widest row)
+HEADER_SEARCH_ROWS = 50
+INSERT_BATCH_SIZE = 1000
+CSV_ENCODING = 'utf-8'
+
+DATE_COLUMN_PATTERN = r'^(date|time|year|month|season|period)\b'
+LOCATION_COLUMN_PATTERN = (r'^(x|y|lat|latitude|lon|longitude|easting|northing|'
+                           r'projection_[xy]_coordinate|region|location|grid[ _]?box)$')
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS files ('
+    'id INTEGER PRIMARY KEY, path TEXT UNIQUE, header TEXT, data_inputs TEXT)',
+    'CREATE TABLE IF NOT EXISTS data ('
+    'file_id INTEGER, row_index INTEGER, date TEXT, location TEXT, '
+    'column_name TEXT, value TEXT, number REAL)',
+    'CREATE INDEX IF NOT EXISTS data_date ON data (date)',
+    'CREATE INDEX IF NOT EXISTS data_location_date ON data (location, date)',
+    'CREATE INDEX IF NOT EXISTS data_file_id ON data (file_id)',
+)
+
+
+def _to_number(value):
+    """
+    Converts a CSV value to a float, or None if it is not numeric.
+
+    :param value: CSV field [String]
+    :return: float or None
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class CsvIndex(object):
+    """
+    Local SQLite index of CSV outputs.
+    The index can be used from any thread (access is serialised with a lock).
+    """
+
+    def __init__(self, path):
+        """
+        Opens (or creates) the index database at `path`.
+
+        :param path: SQLite database file path [String]
+        """
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock:
+            for statement in SCHEMA:
+                self._conn.execute(statement)
+            self._conn.commit()
+
+    def close(self):
+        """
+        Closes the database connection.
+
+        :return: None
+        """
+        with self._lock:
+            self._conn.close()
+
+    def _read_header(self, reader):
+        """
+        Reads leading rows from `reader` and identifies the header as the first
+        of the widest rows (UKCP CSV files may start with metadata rows).
+        Returns tuple of (header, remaining_rows_read).
+
+        :param reader: CSV reader
+        :return: Tuple of (header, rows)
+        """
+        rows = []
+        for row in reader:
+            rows.append(row)
+            if len(rows) >= HEADER_SEARCH_ROWS:
+                break
+
+        if not rows:
+            return None, []
+
+        width = max(len(row) for row in rows)
+        position = next(i for i, row in enumerate(rows) if len(row) == width)
+
+        return rows[position], rows[position + 1:]
+
+    def add_csv(self, filepath, request_url=None):
+        """
+        Loads the CSV file at `filepath` into the index, replacing any previous
+        copy of the same file. The file is read as UTF-8, and rows are read and
+        inserted in batches, so the file is never held in memory in full.
+
+        :param filepath: CSV file path [String]
+        :param request_url: UKCP API Request URL that produced the file [String]
+        :return: id of the file in the index [int]
+        """
+        filepath = os.path.abspath(filepath)
+        data_inputs = parse_data_inputs(request_url) if request_url else {}
+
+        with self._lock:
+            try:
+                self._remove_csv(filepath)
+                file_id = self._load_csv(filepath, data_inputs)
+            except Exception:
+                self._conn.rollback()
+                raise
+
+            self._conn.commit()
+
+        log.info('Indexed {} with id: {}'.format(filepath, file_id))
+        return file_id
+
+    def _load_csv(self, filepath, data_inputs):
+        """
+        Registers the CSV file at `filepath` in the `files` table and inserts
+        its values into the `data` table. Does not commit.
+
+        :param filepath: CSV file path [String]
+        :param data_inputs: Dictionary of request data inputs
+        :return: id of the file in the index [int]
+        """
+        with io.open(filepath, newline='', encoding=CSV_ENCODING) as csv_file:
+            reader = csv.reader(csv_file)
+            header, rows = self._read_header(reader)
+
+            if not header:
+                raise Exception('No rows found in CSV file: {}'.format(filepath))
+
+            columns = [name.strip() or 'column_{}'.format(i) for i, name in enumerate(header)]
+
+            date_index = next((i for i, name in enumerate(columns)
+                               if re.search(DATE_COLUMN_PATTERN, name, re.I)), None)
+            location_indexes = [i for i, name in enumerate(columns)
+                                if re.search(LOCATION_COLUMN_PATTERN, name, re.I)]
+            value_indexes = [i for i in range(len(columns))
+                             if i != date_index and i not in location_indexes]
+
+            cursor = self._conn.execute(
+                'INSERT INTO files (path, header, data_inputs) VALUES (?, ?, ?)',
+                (filepath, json.dumps(columns), json.dumps(data_inputs)))
+            file_id = cursor.lastrowid
+
+            insert = 'INSERT INTO data VALUES (?, ?, ?, ?, ?, ?, ?)'
+            batch = []
+
+            for row_index, row in enumerate(self._iter_rows(rows, reader)):
+                # Pad rows to the header width
+                row = row + [''] * (len(columns) - len(row))
+
+                date = row[date_index].strip() if date_index is not None else None
+
+                if location_indexes:
+                    location = '|'.join(row[i].strip() for i in location_indexes)
+                else:
+                    location = data_inputs.get('Area')
+
+                for i in value_indexes:
+                    value = row[i].strip()
+                    batch.append((file_id, row_index, date, location, columns[i],
+                                  value, _to_number(value)))
+
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    self._conn.executemany(insert, batch)
+                    batch = []
+
+            if batch:
+                self._conn.executemany(insert, batch)
+
+        return file_id
+
+    def _iter_rows(self, rows, reader):
+        """
+        Yields the rows already read, followed by the rest of `reader`.
+        Blank rows are skipped.
+
+        :param rows: Rows already read
+        :param reader: CSV reader
+        :return: Generator of rows
+        """
+        for source in (rows, reader):
+            for row in source:
+                if any(value.strip() for value in row):
+                    yield row
+
+    def remove_csv(self, filepath):
+        """
+        Removes the CSV file at `filepath` from the index, if present.
+
+        :param filepath: CSV file path [String]
+        :return: None
+        """
+        with self._lock:
+            self._remove_csv(os.path.abspath(filepath))
+            self._conn.commit()
+
+    def _remove_csv(self, filepath):
+        """
+        Removes the CSV file at `filepath` from the index. Does not commit.
+
+        :param filepath: Absolute CSV file path [String]
+        :return: None
+        """
+        found = self._conn.execute('SELECT id FROM files WHERE path = ?', (filepath,)).fetchone()
+
+        if found:
+            self._conn.execute('DELETE FROM data WHERE file_id = ?', found)
+            self._conn.execute('DELETE FROM files WHERE id = ?', found)
+
+    def find_files(self, **data_inputs):
+        """
+        Returns the ids of files whose request `DataInputs` match all of the
+        given values, e.g. `find_files(TemporalAverage='jja', Variable='psl')`.
+
+        :param data_inputs: Data input names and values to match
+        :return: List of file ids
+        """
+        file_ids = []
+
+        for file_id, stored in self.query('SELECT id, data_inputs FROM files ORDER BY id'):
+            stored = json.loads(stored)
+
+            if all(stored.get(key) == value for key, value in data_inputs.items()):
+                file_ids.append(file_id)
+
+        return file_ids
+
+    def lookup(self, date_from=None, date_to=None, location=None, column_name=None,
+               **data_inputs):
+        """
+        Returns the values matching all of the given conditions across all files,
+        as a list of (path, row_index, date, location, column_name, value, number)
+        tuples. Dates are compared as text.
+
+        :param date_from: Earliest date (inclusive) [String]
+        :param date_to: Latest date (inclusive) [String]
+        :param location: Location, as stored in the `location` column [String]
+        :param column_name: CSV column name [String]
+        :param data_inputs: Data input names and values the files must match
+        :return: List of tuples
+        """
+        conditions, params = [], []
+
+        for condition, param in (('data.date >= ?', date_from), ('data.date <= ?', date_to),
+                                 ('data.location = ?', location),
+                                 ('data.column_name = ?', column_name)):
+            if param is not None:
+                conditions.append(condition)
+                params.append(param)
+
+        if data_inputs:
+            file_ids = self.find_files(**data_inputs)
+            if not file_ids:
+                return []
+
+            conditions.append('data.file_id IN ({})'.format(', '.join('?' * len(file_ids))))
+            params.extend(file_ids)
+
+        sql = ('SELECT files.path, data.row_index, data.date, data.location, data.column_name, '
+               'data.value, data.number FROM data JOIN files ON files.id = data.file_id')
+
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        return self.query(sql + ' ORDER BY data.file_id, data.row_index', params)
+
+    def query(self, sql, params=()):
+        """
+        Runs an SQL query against the index and returns all rows.
+
+        :param sql: SQL query [String]
+        :param params: Query parameters
+        :return: List of row tuples
+        """
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
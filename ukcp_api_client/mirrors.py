@@ -0,0 +1,282 @@
+"""
+mirrors.py
+==========
+
+Holds the MirrorSession class: a session that sends requests to a list of
+equivalent service endpoints (mirrors, local proxies or caches), with fail-over
+and optional hedging.
+
+Usage:
+>>> from ukcp_api_client.mirrors import MirrorSession
+>>> session = MirrorSession(['https://ukclimateprojections-ui.metoffice.gov.uk',
+...                          'http://localhost:8080'], hedge_after=2)
+>>> cli = UKCPApiClient(outputs_dir='my-outputs', api_key=api_key, session=session)
+
+Any URL that starts with one of the base URLs, or with the UKCP service URL
+(including the `statusLocation` and `FileURL` values returned by the server), is
+sent to the base URLs instead. The service URL itself is only used if it is in
+the list. The base URLs are tried in the order given:
+
+- Fail-over: if a request fails (connection error or 5xx response), it is sent
+  to the next base URL.
+- Hedging: if `hedge_after` is set and a status poll or download has not
+  started to respond (i.e. sent its headers) within that many seconds, a
+  duplicate is sent to the next base URL and whichever responds first is used.
+  Only the time to the first response is hedged: once a response has been
+  chosen, its body is read from that base URL alone, however slowly it arrives.
+
+Execute requests are never hedged (that would submit the job twice) and only
+fail over on errors raised before the request was sent (e.g. the connection
+could not be made). Errors such as read timeouts are raised, since the server
+may already have received the request.
+"""
+
+import time
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+
+
+DEFAULT_BASE_URL = 'https://ukclimateprojections-ui.metoffice.gov.uk'
+
+
+def _is_execute_request(url):
+    """
+    Returns True if `url` is a WPS Execute request (which is not idempotent).
+
+    :param url: URL [String]
+    :return: Boolean
+    """
+    return 'request=execute' in url.lower()
+
+
+def _is_unsent_error(err):
+    """
+    Returns True if `err` was raised before the request was sent, so that it is
+    safe to send it again elsewhere (connection refused, unknown host or connect
+    timeout).
+
+    :param err: Exception raised by `requests`
+    :return: Boolean
+    """
+    if isinstance(err, requests.ConnectTimeout):
+        return True
+
+    if isinstance(err, requests.ConnectionError) and err.args:
+        reason = getattr(err.args[0], 'reason', err.args[0])
+        return isinstance(reason, NewConnectionError)
+
+    return False
+
+
+def _is_server_error(response):
+    """
+    Returns True if `response` has a 5xx status code.
+
+    :param response: Response object
+    :return: Boolean
+    """
+    return response.status_code >= 500
+
+
+class MirrorSession(object):
+    """
+    Session that fails over, and optionally hedges, requests across a list of
+    equivalent base URLs.
+    """
+
+    def __init__(self, base_urls, hedge_after=None, session=None, service_url=DEFAULT_BASE_URL):
+        """
+        :param base_urls: List of equivalent base URLs, in order of preference
+        :param hedge_after: Seconds to wait before sending a duplicate request
+                            to the next base URL (None: no hedging) [float]
+        :param session: Object used to make each request, providing
+                        `get(url, **kwargs)` (default: `requests`)
+        :param service_url: Base URL of the UKCP service, as found in request URLs
+                            and server responses [String]
+        """
+        if not base_urls:
+            raise ValueError('Must provide at least one base URL.')
+
+        self._base_urls = [base_url.rstrip('/') for base_url in base_urls]
+        self._hedge_after = hedge_after
+        self._session = session or requests
+        self._service_url = service_url.rstrip('/')
+
+    def get_urls(self, url):
+        """
+        Returns the list of equivalent URLs for `url`, one per base URL.
+        If `url` does not start with a known base URL (or the service URL),
+        it is returned unchanged.
+
+        :param url: URL [String]
+        :return: List of URLs
+        """
+        for base_url in self._base_urls + [self._service_url]:
+            if url.startswith(base_url + '/') or url == base_url:
+                path = url[len(base_url):]
+                return [other + path for other in self._base_urls]
+
+        return [url]
+
+    def get(self, url, **kwargs):
+        """
+        Makes a GET request to the first base URL that responds successfully.
+
+        :param url: URL [String]
+        :return: Response object
+        """
+        urls = self.get_urls(url)
+
+        if _is_execute_request(url):
+            return self._fail_over(urls, retry_on_server_error=False, **kwargs)
+
+        if self._hedge_after is None or len(urls) == 1:
+            return self._fail_over(urls, **kwargs)
+
+        return self._hedge(urls, **kwargs)
+
+    def _fail_over(self, urls, retry_on_server_error=True, **kwargs):
+        """
+        Tries each of `urls` in turn until one responds.
+
+        If `retry_on_server_error` is False (for requests that must not be sent
+        twice), only errors raised before the request was sent move on to the
+        next URL; any other error is raised.
+
+        :param urls: List of equivalent URLs
+        :param retry_on_server_error: Also move on after a 5xx response or an
+                                      error after the request was sent [Boolean]
+        :return: Response object
+        """
+        for i, url in enumerate(urls):
+            is_last = (i == len(urls) - 1)
+
+            try:
+                response = self._session.get(url, **kwargs)
+            except requests.RequestException as err:
+                if is_last or not (retry_on_server_error or _is_unsent_error(err)):
+                    raise
+
+                log.warning('Request failed, trying next mirror: {}'.format(err))
+                continue
+
+            if retry_on_server_error and _is_server_error(response) and not is_last:
+                log.warning('Got status {} from mirror, trying next mirror.'
+                            .format(response.status_code))
+                response.close()
+                continue
+
+            return response
+
+    def _close_queued(self, results):
+        """
+        Closes any responses waiting in the `results` queue.
+
+        :param results: Queue of (url, response, error) tuples
+        :return: None
+        """
+        while True:
+            try:
+                _, response, _ = results.get_nowait()
+            except queue.Empty:
+                return
+
+            if response is not None:
+                response.close()
+
+    def _hedge(self, urls, **kwargs):
+        """
+        Sends the request to the first of `urls` and, each time `hedge_after`
+        seconds pass without a response (or a request fails), also sends it to the
+        next one. Returns the first successful response; other responses are closed.
+        The race ends when the headers arrive, so a slow body is not hedged.
+
+        :param urls: List of equivalent URLs
+        :return: Response object
+        """
+        results = queue.Queue()
+        lock = threading.Lock()
+        state = {'done': False}
+
+        def _request(url):
+            start = time.time()
+
+            try:
+                result = (url, self._session.get(url, **kwargs), None)
+            except Exception as err:
+                result = (url, None, err)
+
+            log.debug('Mirror responded in %.3f seconds: %s', time.time() - start, url)
+
+            with lock:
+                if not state['done']:
+                    results.put(result)
+                    return
+
+            # A response has already been used, so discard this one
+            if result[1] is not None:
+                result[1].close()
+
+        def _launch(url):
+            thread = threading.Thread(target=_request, args=(url,))
+            thread.daemon = True
+            thread.start()
+
+        _launch(urls[0])
+        launched, pending = 1, 1
+        failure = None
+
+        while True:
+            timeout = self._hedge_after if launched < len(urls) else None
+
+            try:
+                url, response, err = results.get(timeout=timeout)
+            except queue.Empty:
+                log.info('No response after {} seconds, hedging request to: {}'
+                         .format(self._hedge_after, urls[launched]))
+                _launch(urls[launched])
+                launched += 1
+                pending += 1
+                continue
+
+            pending -= 1
+
+            if response is not None and not _is_server_error(response):
+                with lock:
+                    state['done'] = True
+
+                # Close any other responses that have already arrived
+                self._close_queued(results)
+                if failure is not None and failure[0] is not None:
+                    failure[0].close()
+
+                return response
+
+            # Keep the failure in case no mirror succeeds
+            if failure is not None and failure[0] is not None:
+                failure[0].close()
+            failure = (response, err)
+
+            if launched < len(urls):
+                _launch(urls[launched])
+                launched += 1
+                pending += 1
+            elif pending == 0:
+                with lock:
+                    state['done'] = True
+
+                if failure[0] is not None:
+                    return failure[0]
+
+                raise failure[1]
@@ -0,0 +1,184 @@
+"""
+planner.py
+==========
+
+Functions to estimate the relative cost of UKCP API requests and to order
+(or pack) batches of requests based on that estimate.
+
+The estimate is a heuristic built from the `DataInputs` of the request URL:
+
+- number of grid cells covered by the `Area` (bbox area / grid resolution)
+- number of years in the `TimeSlice`
+- a weighting for the `Collection`
+- an extra cost when an image output is requested
+
+It is only meaningful for comparing requests against each other.
+"""
+
+import re
+
+try:
+    from urllib.parse import unquote
+except ImportError:
+    from urllib import unquote
+
+
+# Approximate grid resolution (km) of each collection
+COLLECTION_RESOLUTIONS = {
+    'land-cpm': 5,
+    'land-rcm': 12,
+    'land-prob': 25,
+    'land-gcm': 60,
+}
+DEFAULT_RESOLUTION = 25
+
+# Relative cost of processing one grid cell for one year
+COLLECTION_WEIGHTS = {
+    'land-prob': 3.0,
+    'land-rcm': 1.0,
+    'land-cpm': 1.0,
+    'land-gcm': 1.0,
+}
+DEFAULT_WEIGHT = 1.0
+
+# Number of grid cells assumed for areas that are not a point or bbox (e.g. regions)
+DEFAULT_AREA_CELLS = 100
+IMAGE_COST = 50.0
+
+STRATEGIES = ('shortest_first', 'largest_first')
+
+
+def parse_data_inputs(request_url):
+    """
+    Extracts the `DataInputs` from a request URL as a dictionary of
+    {<input name>: <value>}.
+
+    :param request_url: UKCP API Request URL [String]
+    :return: Dictionary of data inputs
+    """
+    match = re.search('DataInputs=([^&]*)', request_url)
+    if not match:
+        return {}
+
+    data_inputs = {}
+
+    for item in unquote(match.group(1)).split(';'):
+        if '=' not in item:
+            continue
+
+        key, value = item.split('=', 1)
+        data_inputs[key] = value
+
+    return data_inputs
+
+
+def _count_cells(area, collection):
+    """
+    Returns the approximate number of grid cells covered by `area`.
+
+    :param area: Value of `Area` input, e.g. "bbox|x0|y0|x1|y1" [String]
+    :param collection: Value of `Collection` input [String]
+    :return: number of grid cells [float]
+    """
+    if not area:
+        return DEFAULT_AREA_CELLS
+
+    parts = area.split('|')
+    area_type = parts[0]
+
+    if area_type == 'point':
+        return 1
+
+    if area_type != 'bbox' or len(parts) != 5:
+        return DEFAULT_AREA_CELLS
+
+    try:
+        x0, y0, x1, y1 = [float(value) for value in parts[1:]]
+    except ValueError:
+        return DEFAULT_AREA_CELLS
+
+    # Coordinates are in metres (British National Grid)
+    area_km2 = abs(x1 - x0) * abs(y1 - y0) / 1e6
+    resolution = COLLECTION_RESOLUTIONS.get(collection, DEFAULT_RESOLUTION)
+
+    return max(1, area_km2 / resolution ** 2)
+
+
+def _count_years(time_slice):
+    """
+    Returns the number of years in `time_slice`, which may be of the form
+    "2075|2076", "2050-2069" or "2050".
+
+    :param time_slice: Value of `TimeSlice` input [String]
+    :return: number of years [int]
+    """
+    years = [int(year) for year in re.findall(r'\d{4}', time_slice or '')]
+
+    if not years:
+        return 1
+
+    return max(years) - min(years) + 1
+
+
+def estimate_cost(request_url):
+    """
+    Estimates the relative cost of a request from its `DataInputs`.
+
+    :param request_url: UKCP API Request URL [String]
+    :return: relative cost [float]
+    """
+    data_inputs = parse_data_inputs(request_url)
+    collection = data_inputs.get('Collection')
+
+    cells = _count_cells(data_inputs.get('Area'), collection)
+    years = _count_years(data_inputs.get('TimeSlice'))
+    weight = COLLECTION_WEIGHTS.get(collection, DEFAULT_WEIGHT)
+
+    cost = weight * cells * years
+
+    if 'ImageFormat' in data_inputs:
+        cost += IMAGE_COST
+
+    return cost
+
+
+def order_requests(request_urls, strategy='shortest_first'):
+    """
+    Returns the request URLs sorted by estimated cost.
+
+    - 'shortest_first': cheapest first (lowest average time to results)
+    - 'largest_first': most expensive first (avoids one big job starting last)
+
+    :param request_urls: List of UKCP API Request URLs
+    :param strategy: One of STRATEGIES [String]
+    :return: List of request URLs
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError('Unknown strategy: {}. Must be one of: {}'
+                         .format(strategy, ', '.join(STRATEGIES)))
+
+    return sorted(request_urls, key=estimate_cost, reverse=(strategy == 'largest_first'))
+
+
+def pack_requests(request_urls, n_workers):
+    """
+    Distributes the request URLs across `n_workers` queues so that the total
+    estimated cost of each queue is as even as possible (largest requests are
+    placed first, each onto the currently cheapest queue).
+
+    :param request_urls: List of UKCP API Request URLs
+    :param n_workers: Number of queues [int]
+    :return: List of `n_workers` lists of request URLs
+    """
+    if n_workers < 1:
+        raise ValueError('Number of workers must be at least 1.')
+
+    queues = [[] for _ in range(n_workers)]
+    totals = [0.0] * n_workers
+
+    for request_url in order_requests(request_urls, strategy='largest_first'):
+        index = totals.index(min(totals))
+        queues[index].append(request_url)
+        totals[index] += estimate_cost(request_url)
+
+    return queues
@@ -6,10 +6,12 @@ Utility functions and objects for API client.
 
 """
 
+import os
 import time
 import re
+import socket
 import logging
-import shutil
+import threading
 import xml.etree.ElementTree as ET
 
 import requests
@@ -29,6 +31,217 @@ NS = '{http://www.opengeospatial.net/wps}'
 OWS_NS = '{http://www.opengeospatial.net/ows}'
 OWS_ERROR_NS = '{http://www.opengis.net/ows/1.1}'
 POLLING_PAUSE = 2
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+MAX_RESPONSE_SIZE = 10 * 1024 * 1024
+
+API_KEY_PATTERN = '([?&])ApiKey=[^&]*&?'
+XML_ENCODING_PATTERN = br'^\s*<\?xml[^>]*encoding=["\']([A-Za-z0-9._-]+)["\']'
+CHARSET_PATTERN = r'charset=["\']?([A-Za-z0-9._-]+)'
+
+
+class JobCancelled(Exception):
+    """
+    Raised when a job is cancelled while polling or downloading.
+    """
+    pass
+
+
+class ResponseTooLarge(Exception):
+    """
+    Raised when an XML Response document exceeds the maximum allowed size.
+    """
+    pass
+
+
+def strip_api_key(url):
+    """
+    Removes the `ApiKey` parameter from `url`, so that it is not passed to
+    progress callbacks or written to cassettes.
+
+    :param url: URL [String]
+    :return: URL without API Key [String]
+    """
+    url = re.sub(API_KEY_PATTERN, r'\1', url)
+    return url.rstrip('?&')
+
+
+def _abort_response(response):
+    """
+    Closes `response`. If its connection is still open, the socket is shut
+    down first so that a read blocked in another thread returns straight away.
+
+    :param response: Response object
+    :return: None
+    """
+    connection = getattr(getattr(response, 'raw', None), 'connection', None)
+    sock = getattr(connection, 'sock', None)
+
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except (OSError, socket.error):
+            pass
+
+    response.close()
+
+
+class CancelEvent(object):
+    """
+    Cancellation flag for a job, with the same interface as `threading.Event`.
+    Responses that are being read can be registered with `track`, so that
+    setting the flag also aborts them.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._responses = []
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+    def clear(self):
+        self._event.clear()
+
+    def set(self):
+        """
+        Sets the flag and aborts all tracked responses.
+        """
+        with self._lock:
+            self._event.set()
+            responses, self._responses = self._responses, []
+
+        for response in responses:
+            _abort_response(response)
+
+    def track(self, response):
+        """
+        Registers `response` to be aborted when the flag is set.
+        If it is already set, the response is aborted straight away.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._responses.append(response)
+                return
+
+        _abort_response(response)
+
+    def untrack(self, response):
+        """
+        Stops tracking `response`.
+        """
+        with self._lock:
+            if response in self._responses:
+                self._responses.remove(response)
+
+
+def _track(cancel_event, response):
+    """
+    Registers `response` with `cancel_event`, if it supports tracking.
+
+    :param cancel_event: Cancellation flag [CancelEvent, threading.Event or None]
+    :param response: Response object
+    :return: None
+    """
+    if hasattr(cancel_event, 'track'):
+        cancel_event.track(response)
+
+
+def _untrack(cancel_event, response):
+    """
+    Removes `response` from `cancel_event`, if it supports tracking.
+
+    :param cancel_event: Cancellation flag [CancelEvent, threading.Event or None]
+    :param response: Response object
+    :return: None
+    """
+    if hasattr(cancel_event, 'untrack'):
+        cancel_event.untrack(response)
+
+
+def _notify(callback, **event):
+    """
+    Send a progress event (a dictionary) to `callback` if one was provided.
+
+    :param callback: Progress callback [callable or None]
+    :param event: Keyword arguments making up the event
+    :return: None
+    """
+    if callback:
+        callback(event)
+
+
+def _check_cancelled(cancel_event):
+    """
+    Raises JobCancelled if `cancel_event` has been set.
+
+    :param cancel_event: Cancellation flag [CancelEvent, threading.Event or None]
+    :return: None
+    """
+    if cancel_event is not None and cancel_event.is_set():
+        raise JobCancelled('Job was cancelled.')
+
+
+def read_xml_response(response, max_size=MAX_RESPONSE_SIZE):
+    """
+    Read the body of a streamed `response` as bytes, without decoding it.
+    Raises ResponseTooLarge as soon as more than `max_size` bytes have been read,
+    so that an unexpectedly large body (e.g. a proxy error page) is never
+    held in memory in full.
+
+    :param response: Response from `requests.get(..., stream=True)`
+    :param max_size: Maximum body size in bytes [int]
+    :return: XML Response Document [bytes]
+    """
+    try:
+        length = int(response.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        length = None
+
+    if length is not None and length > max_size:
+        response.close()
+        raise ResponseTooLarge('Response from {} is too large: {} bytes (maximum is {}).'
+                               .format(response.url, length, max_size))
+
+    chunks, size = [], 0
+
+    try:
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            size += len(chunk)
+
+            if size > max_size:
+                raise ResponseTooLarge('Response from {} exceeded maximum size of {} bytes.'
+                                       .format(response.url, max_size))
+
+            chunks.append(chunk)
+    finally:
+        response.close()
+
+    return b''.join(chunks)
+
+
+def decode_xml(xml, content_type=None):
+    """
+    Decodes an XML Response document read as bytes. Uses the encoding from the
+    XML declaration, then the charset from `content_type`, then UTF-8 (ignoring
+    any byte order mark).
+
+    :param xml: XML Response Document [bytes]
+    :param content_type: Value of the response Content-Type header [String]
+    :return: XML Response Document [String]
+    """
+    match = re.search(XML_ENCODING_PATTERN, xml[:200])
+
+    if match:
+        encoding = match.group(1).decode('ascii')
+    else:
+        match = re.search(CHARSET_PATTERN, content_type or '')
+        encoding = match.group(1) if match else 'utf-8-sig'
+
+    return xml.decode(encoding)
 
 
 def validate_api_key(api_key):
@@ -49,11 +262,13 @@ def validate_api_key(api_key):
 
 def get_status_url(xml):
     """
+    Gets the status URL from the Execute Response XML document.
+    Raises Exception (with any error message from the server) if it is missing.
 
-    :param xml: XML Response Document [String]
-    :return:
+    :param xml: XML Response Document [String or bytes]
+    :return: Status URL [String]
     """
-    log.debug('XML Response: \n{}'.format(xml))
+    log.debug('XML Response: \n%s', xml)
     root = ET.fromstring(xml)
     status_url = root.get('statusLocation', None)
 
@@ -74,7 +289,7 @@ def get_status_and_message(xml):
     Searches XML Response document for status information.
     Returns tuple of (status, status_message).
 
-    :param xml: XML Response Document [String]
+    :param xml: XML Response Document [String or bytes]
     :return: Tuple of (status, message)
     """
     root = ET.fromstring(xml)
@@ -93,37 +308,81 @@ def get_status_and_message(xml):
     return status, message
 
 
+def get_percent_completed(xml):
+    """
+    Searches XML Response document for the `percentCompleted` attribute of the
+    status element. Returns None if the server did not report it.
+
+    :param xml: XML Response Document [String or bytes]
+    :return: percent completed [int or None]
+    """
+    root = ET.fromstring(xml)
+    qual_status = root.find(NS + 'Status')[0]
+    percent = qual_status.get('percentCompleted', None)
+
+    try:
+        return int(percent)
+    except (TypeError, ValueError):
+        return None
+
+
 def get_status(xml):
     """
     Searches XML Response document for status information.
     Returns status.
 
-    :param xml: XML Response Document [String]
+    :param xml: XML Response Document [String or bytes]
     :return: status [String]
     """
     status, _ = get_status_and_message(xml)
     return status
 
 
-def poll_until_ready(status_url):
+def poll_until_ready(status_url, callback=None, cancel_event=None, session=None):
     """
     Keep polling the URL `status_url` until the XML Response document returns
     a status that can be responded to (i.e. either a success or failure).
 
+    If `callback` is given it is called with a "status" event each time the
+    status is polled. If `cancel_event` is set, polling stops and JobCancelled
+    is raised. A `CancelEvent` also aborts a status response being read.
+
     :param status_url: Status URL [String]
+    :param callback: Progress callback [callable]
+    :param cancel_event: Cancellation flag [CancelEvent or threading.Event]
+    :param session: Object providing `get(url, **kwargs)` (default: `requests`)
     :return: Tuple of (status, xml_doc)
     """
     status, response = None, None
 
     while status not in FINAL_STATUS_VALUES:
         log.info('Pausing for {} seconds before polling server...'.format(POLLING_PAUSE))
-        time.sleep(POLLING_PAUSE)
-        response = requests.get(status_url)
-        xml = response.text
+
+        if cancel_event is not None:
+            cancel_event.wait(POLLING_PAUSE)
+        else:
+            time.sleep(POLLING_PAUSE)
+
+        _check_cancelled(cancel_event)
+        response = (session or requests).get(status_url, stream=True)
+        _track(cancel_event, response)
+
+        try:
+            xml = read_xml_response(response)
+        except Exception:
+            # An aborted read is reported as a cancellation
+            _check_cancelled(cancel_event)
+            raise
+        finally:
+            _untrack(cancel_event, response)
+
         status = get_status(xml)
 
-    log.debug('XML:\n{}'.format(xml))
-    return status, xml
+        _notify(callback, event='status', status=status,
+                percent_completed=get_percent_completed(xml))
+
+    log.debug('XML:\n%s', xml)
+    return status, decode_xml(xml, response.headers.get('Content-Type'))
 
 
 def get_file_urls(xml):
@@ -132,7 +391,7 @@ def get_file_urls(xml):
     can be downloaded.
     Returns a list of file URLs.
 
-    :param xml: XML Response Document [String]
+    :param xml: XML Response Document [String or bytes]
     :return: List of file URLs
     """
     root = ET.fromstring(xml)
@@ -146,18 +405,65 @@ def get_file_urls(xml):
     return file_urls
 
 
-def save_url_to_local_file(url, filepath):
+def save_url_to_local_file(url, filepath, callback=None, cancel_event=None, session=None):
     """
     Download a file from URL `url` and save to local path `filepath`.
 
+    If `callback` is given it is called with a "download" event after each
+    chunk is written. If the download is cancelled (via `cancel_event`) or
+    interrupted, or fewer bytes than the `Content-Length` are received, the
+    partial file is removed. A `CancelEvent` also aborts the download while
+    it is waiting for data.
+
     :param url: URL to a file [String]
     :param filepath: Local file path to write the file [String]
+    :param callback: Progress callback [callable]
+    :param cancel_event: Cancellation flag [CancelEvent or threading.Event]
+    :param session: Object providing `get(url, **kwargs)` (default: `requests`)
     :return: None
     """
-    # Get file as stream - to avoid loading all into memory
-    response = requests.get(url, stream=True)
+    _check_cancelled(cancel_event)
 
-    # Open local file for writing
-    with open(filepath, "wb") as local_file:
-        shutil.copyfileobj(response.raw, local_file)
+    # Get file as stream - to avoid loading all into memory
+    response = (session or requests).get(url, stream=True)
+    _track(cancel_event, response)
+
+    try:
+        total = int(response.headers.get('Content-Length'))
+    except (TypeError, ValueError):
+        total = None
+
+    # The length of an encoded body is not the length of the decoded file
+    expected = total if not response.headers.get('Content-Encoding') else None
+    downloaded = 0
+    event_url = strip_api_key(url)
+
+    try:
+        # Open local file for writing
+        with open(filepath, "wb") as local_file:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                _check_cancelled(cancel_event)
+                local_file.write(chunk)
+                downloaded += len(chunk)
+
+                _notify(callback, event='download', url=event_url, target=filepath,
+                        bytes=downloaded, total=total)
+
+        # An aborted response may end without an error
+        _check_cancelled(cancel_event)
+
+        if expected is not None and downloaded != expected:
+            raise Exception('Download of {} was incomplete: received {} of {} bytes.'
+                            .format(event_url, downloaded, expected))
+    except BaseException:
+        # Do not leave truncated files behind
+        if os.path.exists(filepath):
+            os.remove(filepath)
+
+        # An aborted read is reported as a cancellation
+        _check_cancelled(cancel_event)
+        raise
+    finally:
+        _untrack(cancel_event, response)
+        response.close()
 